@@ -123,10 +123,13 @@ def read_history(path):
     
     for i in range(n_passengers):
         passengers[i].history = []
-        n_entries = parse_line(reader)[0]
+        pid, n_entries = parse_line(reader)
         for j in range(n_entries):
             h = dict(zip(['step', 'x', 'y', 'state'], parse_line(reader)))
             passengers[i].history.append(h)
+
+    # Only passengers with recorded history are shown (see Simulation.replay()).
+    passengers = [p for p in passengers if p.history]
             
     for i in range(n_baggage):
         t, row, side = parse_line(reader)
@@ -0,0 +1,150 @@
+import copy
+
+import numpy as np
+
+from plane_boarding import State
+
+
+# Collectors gather statistics incrementally while the simulation runs, so that they don't require keeping the full
+# history (see Simulation's `keep_history`). They are attached with Simulation.add_collector(), and aggregate the
+# statistics over all the runs (e.g. all replicas of run_multiple()). With collectors attached, run_multiple() simulates
+# every replica, even if its result is cached.
+#
+# Passengers are indexed in the boarding order (1 is the first to board), as in the simulation itself.
+class Collector:
+	def __init__(self):
+		self.reset()
+
+	# Clears gathered statistics (but keeps the settings).
+	def reset(self):
+		self.n_runs = 0
+
+	# Returns a collector with the same settings and no statistics, e.g. for a simulation running in another thread.
+	def empty_copy(self):
+		collector = copy.copy(self)
+		collector.reset()
+		return collector
+
+	def on_run_start(self, simulation):
+		pass
+
+	def on_state_change(self, simulation, pid, old_state, new_state):
+		pass
+
+	# Called when passengers must leave a row to let someone in. `passengers` are ordered as in RowVacating.
+	def on_row_vacating(self, simulation, row, passengers):
+		pass
+
+	# Called after every simulation step.
+	def on_step(self, simulation):
+		pass
+
+	def on_run_end(self, simulation):
+		self.n_runs += 1
+
+	# Adds statistics gathered by another collector of the same type (e.g. running in another process).
+	def merge(self, other):
+		self.n_runs += other.n_runs
+
+
+# Total time spent in every state, per passenger. `time_in_state[pid, state]` is summed over all runs. Passengers are
+# SEATED from the time they sit down until the end of the run, so every passenger's times add up to the boarding time.
+class StateTimeCollector(Collector):
+	def reset(self):
+		super().reset()
+		self.time_in_state = None
+		self.run_time_in_state = None
+		self.state_start_t = None
+
+	def on_run_start(self, simulation):
+		if self.time_in_state is None:
+			self.time_in_state = np.zeros((simulation.n_passengers+1, len(State)), dtype=np.int64)
+		elif self.time_in_state.shape[0] != simulation.n_passengers+1:
+			raise ValueError('StateTimeCollector requires the same number of passengers in all runs')
+		self.run_time_in_state = np.zeros_like(self.time_in_state)
+		self.state_start_t = np.zeros(simulation.n_passengers+1, dtype=np.int64)
+
+	def on_state_change(self, simulation, pid, old_state, new_state):
+		self.run_time_in_state[pid, old_state] += simulation.t - self.state_start_t[pid]
+		self.state_start_t[pid] = simulation.t
+
+	def on_run_end(self, simulation):
+		super().on_run_end(simulation)
+		# Close the current (final) state of every passenger.
+		for pid in range(1, simulation.n_passengers+1):
+			self.run_time_in_state[pid, simulation.passengers[pid].state] += simulation.t - self.state_start_t[pid]
+		if np.any(self.run_time_in_state[1:].sum(axis=1) != simulation.t):
+			raise RuntimeError('Time in states does not add up to the boarding time')
+		self.time_in_state += self.run_time_in_state
+
+	def merge(self, other):
+		super().merge(other)
+		if self.time_in_state is None:
+			self.time_in_state = None if other.time_in_state is None else other.time_in_state.copy()
+		elif other.time_in_state is not None:
+			self.time_in_state += other.time_in_state
+
+	# Average time spent in every state per passenger (averaged over runs).
+	def mean_time_in_state(self):
+		return self.time_in_state / max(1, self.n_runs)
+
+
+# Aisle occupancy by row and time. `occupancy[row, bucket]` is the number of steps (summed over all runs) the aisle
+# in a given row was occupied during a given time bucket. The last bucket also gathers all the later steps.
+class AisleOccupancyCollector(Collector):
+	def __init__(self, bucket_size=10, n_buckets=100):
+		self.bucket_size = bucket_size
+		self.n_buckets = n_buckets
+		super().__init__()
+
+	def reset(self):
+		super().reset()
+		self.occupancy = None
+
+	def on_run_start(self, simulation):
+		n_rows = simulation.n_rows + simulation.dummy_rows
+		if self.occupancy is None:
+			self.occupancy = np.zeros((n_rows, self.n_buckets), dtype=np.int64)
+		elif self.occupancy.shape[0] != n_rows:
+			raise ValueError('AisleOccupancyCollector requires the same number of rows in all runs')
+
+	def on_step(self, simulation):
+		bucket = min(simulation.t // self.bucket_size, self.n_buckets - 1)
+		self.occupancy[:, bucket] += simulation.aisle != 0
+
+	def merge(self, other):
+		super().merge(other)
+		if self.occupancy is None:
+			self.occupancy = None if other.occupancy is None else other.occupancy.copy()
+		elif other.occupancy is not None:
+			self.occupancy += other.occupancy
+
+
+# Counts events of passengers vacating a row to let someone else seat, per row (summed over all runs).
+class RowVacatingCollector(Collector):
+	def reset(self):
+		super().reset()
+		self.events = None          # Number of times a row was vacated
+		self.passengers = None      # Number of passengers who had to leave their seat
+
+	def on_run_start(self, simulation):
+		n_rows = simulation.n_rows + simulation.dummy_rows
+		if self.events is None:
+			self.events = np.zeros(n_rows, dtype=np.int64)
+			self.passengers = np.zeros(n_rows, dtype=np.int64)
+		elif self.events.shape[0] != n_rows:
+			raise ValueError('RowVacatingCollector requires the same number of rows in all runs')
+
+	def on_row_vacating(self, simulation, row, passengers):
+		self.events[row] += 1
+		# The last passenger is the one who wants to seat.
+		self.passengers[row] += len(passengers) - 1
+
+	def merge(self, other):
+		super().merge(other)
+		if self.events is None:
+			if other.events is not None:
+				self.events, self.passengers = other.events.copy(), other.passengers.copy()
+		elif other.events is not None:
+			self.events += other.events
+			self.passengers += other.passengers
@@ -0,0 +1,219 @@
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import plane_boarding
+
+
+# Fast surrogate of the full simulation, used to screen boarding methods and configurations before simulating them.
+#
+# For every boarding method the mean and the standard deviation of the boarding time are modelled as a linear
+# combination of simple aisle-blocking terms (see `config_features()`), fitted with least squares on results of the
+# full simulation. The boarding time distribution is then approximated by a normal distribution. The estimator only
+# predicts speeds within the range it was trained on.
+#
+# Training data is either simulated with `simulate()`, or loaded with `load_runs()` from the runs saved by main.py.
+
+MODEL_PATH = '~/plane_boarding/estimator.npz'
+
+# Configurations used to train and validate the estimator. Validation uses aircraft sizes not seen in training.
+TRAIN_ROWS = [8, 12, 16, 20, 24]
+VALIDATION_ROWS = [10, 18, 30]
+SEATS_PER_SIDE = [2, 3]
+PASSENGERS_PROPORTIONS = [0.6, 0.8, 1.0]
+
+# Speeds (move, seating, stow baggage) used in training and validation. Training speeds must vary independently, so
+# that the speed terms of the model can be told apart.
+TRAIN_SPEEDS = [(1, 2, 2), (3, 2, 5), (2, 5, 1), (4, 3, 0)]
+VALIDATION_SPEEDS = [(2, 3, 3), (4, 3, 3), (1, 3, 3), (2, 3, 0)]
+SPEED_FIELDS = ['speed_move', 'speed_seating', 'speed_stow_baggage']
+
+
+# Terms of the linear model. Boarding time is dominated by walking to the back of the plane, and by passengers
+# blocking the aisle while stowing baggage and seating (including making other passengers vacate the row).
+def config_features(config):
+	n_rows = config['n_rows']
+	n_passengers = config['n_passengers']
+	n_seats = max(config['n_seats_left'], config['n_seats_right'])
+	passengers_per_row = n_passengers / n_rows
+	return np.array([
+		1.0,
+		config['speed_move'] * (n_rows + config['dummy_rows']),
+		config['speed_move'] * n_passengers,
+		config['speed_stow_baggage'] * n_passengers,
+		config['speed_seating'] * n_passengers * n_seats,
+		config['speed_seating'] * n_passengers * passengers_per_row,
+	])
+
+
+class Estimator:
+	def __init__(self):
+		self.coef_mean = {}      # Boarding method name -> coefficients of the mean boarding time
+		self.coef_std = {}       # Boarding method name -> coefficients of the boarding time standard deviation
+		self.speed_range = None  # Minimal and maximal training speeds, in the order of SPEED_FIELDS
+
+	# Fits the model to `records`, a list of (config, boarding_times) pairs, as returned by `simulate()` or `load_runs()`.
+	# The standard deviation is fitted only to records with at least 2 runs.
+	# Raises ValueError if the records don't determine all the terms of the model (e.g. speeds were never varied).
+	def fit(self, records):
+		by_method = {}
+		for config, boarding_time in records:
+			by_method.setdefault(config['boarding_zones'], []).append((config, boarding_time))
+
+		for method, method_records in by_method.items():
+			std_records = [(config, boarding_time) for config, boarding_time in method_records if len(boarding_time) > 1]
+			if not std_records:
+				raise ValueError(f'Fitting the standard deviation of {method} requires records with at least 2 runs')
+			self.coef_mean[method] = _fit_terms(method, method_records, np.mean)
+			self.coef_std[method] = _fit_terms(method, std_records, np.std)
+
+		speeds = np.array([[config[name] for name in SPEED_FIELDS] for config, _ in records])
+		self.speed_range = np.array([speeds.min(axis=0), speeds.max(axis=0)])
+		return self
+
+	# Returns predicted (mean, standard deviation) of the boarding time for a configuration.
+	def predict(self, config):
+		method = config['boarding_zones']
+		if method not in self.coef_mean:
+			raise KeyError(f'Estimator was not trained for {method}')
+		speeds = np.array([config[name] for name in SPEED_FIELDS])
+		if np.any(speeds < self.speed_range[0]) or np.any(speeds > self.speed_range[1]):
+			raise ValueError(f'Speeds {speeds.tolist()} are outside the range the estimator was trained on')
+		x = config_features(config)
+		return max(0.0, float(x @ self.coef_mean[method])), max(0.0, float(x @ self.coef_std[method]))
+
+	# Returns predicted quantiles of the boarding time for a configuration. Quantiles must be in (0, 1).
+	def predict_quantiles(self, config, quantiles=(0.05, 0.5, 0.95)):
+		quantiles = np.asarray(quantiles, dtype=float)
+		if np.any((quantiles <= 0) | (quantiles >= 1)):
+			raise ValueError('Quantiles must be strictly between 0 and 1')
+		mean, std = self.predict(config)
+		z = np.sqrt(2) * _erfinv(2 * quantiles - 1)
+		return mean + z * std
+
+	def save(self, path):
+		arrays = {'speed_range': self.speed_range}
+		for method in self.coef_mean:
+			arrays[f'mean_{method}'] = self.coef_mean[method]
+			arrays[f'std_{method}'] = self.coef_std[method]
+		np.savez(path, **arrays)
+
+	@classmethod
+	def load(cls, path):
+		estimator = cls()
+		with np.load(path) as data:
+			estimator.speed_range = data['speed_range']
+			for name in data.files:
+				if name == 'speed_range':
+					continue
+				kind, method = name.split('_', 1)
+				if kind == 'mean':
+					estimator.coef_mean[method] = data[name]
+				else:
+					estimator.coef_std[method] = data[name]
+		return estimator
+
+
+# Least squares fit of `statistic` of the boarding times to the model terms.
+def _fit_terms(method, records, statistic):
+	x = np.array([config_features(config) for config, _ in records])
+	if x.ndim != 2 or np.linalg.matrix_rank(x) < x.shape[1]:
+		raise ValueError(f'Training records of {method} do not determine all the terms of the model')
+	y = np.array([statistic(boarding_time) for _, boarding_time in records])
+	return np.linalg.lstsq(x, y, rcond=None)[0]
+
+
+# Inverse error function (Giles' approximation), to avoid depending on scipy.
+def _erfinv(x):
+	x = np.asarray(x, dtype=float)
+	w = -np.log((1.0 - x) * (1.0 + x))
+	small = w < 5.0
+	w1 = w - 2.5
+	p1 = 2.81022636e-08
+	for c in [3.43273939e-07, -3.5233877e-06, -4.39150654e-06, 0.00021858087, -0.00125372503, -0.00417768164, 0.246640727, 1.50140941]:
+		p1 = c + p1 * w1
+	w2 = np.sqrt(np.maximum(w, 5.0)) - 3.0
+	p2 = -0.000200214257
+	for c in [0.000100950558, 0.00134934322, -0.00367342844, 0.00573950773, -0.0076224613, 0.00943887047, 1.00167406, 2.83297682]:
+		p2 = c + p2 * w2
+	return np.where(small, p1, p2) * x
+
+
+# Runs the full simulation for all combinations of the given settings. `speeds` are (move, seating, stow baggage) tuples.
+# Returns a list of (config, boarding_times) pairs, which can be used to train or validate the estimator.
+def simulate(simulation, rows, seats_per_side, proportions, speeds, n=50, boarding_zones=None):
+	records = []
+	for move, seating, stow_baggage in speeds:
+		simulation.set_speeds(move, seating, stow_baggage)
+		for n_rows in rows:
+			for n_seats in seats_per_side:
+				for proportion in proportions:
+					for boarding_zone in boarding_zones or plane_boarding.BoardingZones:
+						simulation.set_custom_aircraft(n_rows=n_rows, n_seats_left=n_seats, n_seats_right=n_seats)
+						simulation.set_passengers_proportion(proportion)
+						simulation.set_boarding_zones(boarding_zone)
+						simulation.run_multiple(n)
+						records.append((simulation.get_config(), list(simulation.boarding_time)))
+	return records
+
+
+# Loads runs saved by main.py's save_history() (`*_runs.json` files in `path`), to train or validate the estimator
+# without simulating them again. Returns a list of (config, boarding_times) pairs. Records with a single run are used
+# only to fit the mean boarding time.
+def load_runs(path):
+	records = []
+	for file_path in sorted(glob.glob(os.path.join(os.path.expanduser(path), '*_runs.json'))):
+		with open(file_path) as f:
+			runs = json.load(f)
+		records.append((runs['config'], runs['boarding_time']))
+	return records
+
+
+# Compares the estimator with the full simulation results.
+# Returns per-record relative errors of the mean and the standard deviation, and the prediction time per config.
+# The standard deviation error is NaN for records with a single run.
+def benchmark(estimator, records):
+	mean_error = []
+	std_error = []
+	start = time.perf_counter()
+	predictions = [estimator.predict(config) for config, _ in records]
+	prediction_time = (time.perf_counter() - start) / max(1, len(records))
+
+	for (config, boarding_time), (mean, std) in zip(records, predictions):
+		mean_error.append(abs(mean - np.mean(boarding_time)) / np.mean(boarding_time))
+		if len(boarding_time) > 1:
+			std_error.append(abs(std - np.std(boarding_time)) / max(1.0, np.std(boarding_time)))
+		else:
+			std_error.append(np.nan)
+	return np.array(mean_error), np.array(std_error), prediction_time
+
+
+# Trains the estimator on the training grid, and reports its error on the validation grid.
+def main(n=50):
+	simulation = plane_boarding.Simulation(quiet_mode=True, dummy_rows=2)
+	simulation.set_seed(0)
+
+	print('Simulating the training set...')
+	train = simulate(simulation, TRAIN_ROWS, SEATS_PER_SIDE, PASSENGERS_PROPORTIONS, TRAIN_SPEEDS, n=n)
+	estimator = Estimator().fit(train)
+
+	print('Simulating the validation set...')
+	validation = simulate(simulation, VALIDATION_ROWS, SEATS_PER_SIDE, PASSENGERS_PROPORTIONS, VALIDATION_SPEEDS, n=n)
+	mean_error, std_error, prediction_time = benchmark(estimator, validation)
+
+	methods = [config['boarding_zones'] for config, _ in validation]
+	for method in dict.fromkeys(methods):
+		ind = [i for i, m in enumerate(methods) if m == method]
+		print(f'{method.lower():50s} mean error: {100 * np.mean(mean_error[ind]):5.1f}%  std error: {100 * np.nanmean(std_error[ind]):5.1f}%')
+	print(f'Overall mean error: {100 * np.mean(mean_error):.1f}%, max: {100 * np.max(mean_error):.1f}%')
+	print(f'Prediction time: {1e3 * prediction_time:.3f} ms per configuration')
+
+	path = os.path.expanduser(MODEL_PATH)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	estimator.save(path)
+
+
+if __name__ == '__main__':
+	main()
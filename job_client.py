@@ -0,0 +1,76 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import job_server
+
+
+# Client of the local simulation service (see job_server.py).
+#
+# Example:
+#   client = JobClient()
+#   job_ids = client.submit(sweep_specs(simulation, plane_boarding.BoardingZones, [0.8, 1.0], n=1000))
+#   for job_id, boarding_time in client.results(job_ids):
+#       ...
+
+# Job specification for `n` runs of a simulation with its current configuration. The simulation must have a seed set.
+def make_spec(simulation, n):
+	return {'config': simulation.get_config(), 'seed': simulation.seed, 'n': n}
+
+
+# Job specifications for all combinations of boarding methods and passengers proportions.
+def sweep_specs(simulation, boarding_zones, proportions, n):
+	specs = []
+	simulation = simulation.clone()
+	for proportion in proportions:
+		for boarding_zone in boarding_zones:
+			simulation.set_passengers_proportion(proportion)
+			simulation.set_boarding_zones(boarding_zone)
+			specs.append(make_spec(simulation, n))
+	return specs
+
+
+class JobClient:
+	def __init__(self, url=f'http://{job_server.HOST}:{job_server.PORT}'):
+		self.url = url
+
+	def request(self, path, body=None):
+		data = None if body is None else json.dumps(body).encode('utf-8')
+		request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+		try:
+			with urllib.request.urlopen(request) as response:
+				return json.loads(response.read())
+		except urllib.error.HTTPError as e:
+			raise RuntimeError(json.loads(e.read()).get('error', str(e))) from e
+
+	# Submits a batch of jobs, and returns their ids (in the same order).
+	def submit(self, specs):
+		return self.request('/jobs', specs)['job_ids']
+
+	# Returns status of a job: 'status', 'progress' (0-1), and 'boarding_time' once it is done.
+	def status(self, job_id):
+		return self.request('/jobs/' + job_id)
+
+	def server_status(self):
+		return self.request('/status')
+
+	# Yields (job_id, boarding_time) as the jobs finish. Raises RuntimeError if any of them failed.
+	def results(self, job_ids, poll_interval=0.5):
+		pending = list(dict.fromkeys(job_ids))
+		while pending:
+			for job_id in list(pending):
+				status = self.status(job_id)
+				if status['status'] == 'failed':
+					raise RuntimeError(f'Job {job_id} failed: {status.get("error")}')
+				if status['status'] == 'done':
+					pending.remove(job_id)
+					yield job_id, status['boarding_time']
+			if pending:
+				time.sleep(poll_interval)
+
+	# Submits a batch of jobs and waits for all of them. Returns boarding times in the order of `specs`.
+	def run(self, specs, poll_interval=0.5):
+		job_ids = self.submit(specs)
+		results = dict(self.results(job_ids, poll_interval))
+		return [results[job_id] for job_id in job_ids]
@@ -0,0 +1,277 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import plane_boarding
+import result_cache
+
+
+# Local simulation service. Jobs (configuration, seed and number of runs, see job_client.py) are submitted over HTTP
+# on localhost, split into chunks of replicas and run on a pool of worker processes. Chunks in progress are shared by
+# all the jobs that need them (e.g. jobs with 1000 and 2000 runs of the same configuration and seed), and finished
+# results are served from a shared result cache.
+#
+# API (all bodies are JSON):
+#   POST /jobs         - submits a list of jobs, returns their ids
+#   GET  /jobs/<id>    - returns job status and progress, and the boarding times once it is done
+#   GET  /status       - returns the number of jobs in every status
+
+HOST = '127.0.0.1'
+PORT = 8765
+CACHE_DIR = '~/plane_boarding/server_cache'
+
+CHUNK_SIZE = 50                 # Number of replicas run by a worker at once. Progress is reported per chunk.
+MAX_FINISHED_JOBS = 10000       # Finished jobs kept in memory. Older ones are still available in the result cache.
+
+
+@dataclass
+class Job:
+	config: dict
+	seed: int
+	n: int
+	status: str = 'running'          # 'running', 'done' or 'failed'
+	n_chunks: int = 0
+	chunks_done: int = 0
+	boarding_time: list = field(default_factory=list)
+	chunks: dict = field(default_factory=dict)       # Replica index of the chunk start -> boarding times
+	error: str = None
+
+	def to_json(self, with_results=True):
+		result = {
+			'status': self.status,
+			'progress': 1.0 if self.n_chunks == 0 else self.chunks_done / self.n_chunks,
+		}
+		if self.error is not None:
+			result['error'] = self.error
+		if self.status == 'done' and with_results:
+			result['boarding_time'] = self.boarding_time
+		return result
+
+
+# Replicas [start, end) of a configuration and seed being simulated, shared by all the jobs that need them.
+@dataclass
+class Chunk:
+	end: int
+	jobs: list = field(default_factory=list)
+
+
+# Configuration fields and their minimal values. All of them must be integers, apart from `boarding_zones`.
+CONFIG_MIN_VALUES = {
+	'n_rows': 1,
+	'n_seats_left': 0,
+	'n_seats_right': 0,
+	'dummy_rows': 0,
+	'n_passengers': 0,
+	'speed_move': 0,
+	'speed_seating': 0,
+	'speed_stow_baggage': 0,
+	'engine_version': 0,
+}
+
+
+def is_int(value):
+	return isinstance(value, int) and not isinstance(value, bool)
+
+
+# Checks a job specification, and returns its (config, seed, n). Raises ValueError for invalid jobs.
+def validate_spec(spec):
+	if not isinstance(spec, dict) or not isinstance(spec.get('config'), dict):
+		raise ValueError('A job must be an object with a configuration')
+	config, seed, n = spec['config'], spec.get('seed'), spec.get('n')
+	if not is_int(seed):
+		raise ValueError('Jobs require an integer seed')
+	if not is_int(n) or n < 1:
+		raise ValueError('Number of runs must be a positive integer')
+
+	for name, min_value in CONFIG_MIN_VALUES.items():
+		if not is_int(config.get(name)) or config[name] < min_value:
+			raise ValueError(f'Configuration field {name} must be an integer, at least {min_value}')
+	if config.get('boarding_zones') not in plane_boarding.BoardingZones.__members__:
+		raise ValueError(f'Unknown boarding zones: {config.get("boarding_zones")}')
+	if config['n_passengers'] > config['n_rows'] * (config['n_seats_left'] + config['n_seats_right']):
+		raise ValueError('More passengers than seats')
+
+	# Normalizes the configuration to what the current engine would report (and checks the engine version).
+	config = plane_boarding.Simulation.from_config(config).get_config()
+	return config, seed, n
+
+
+# Runs in a worker process.
+def run_replicas(config, seed, replicas):
+	simulation = plane_boarding.Simulation.from_config(config)
+	simulation.set_seed(seed)
+	for i in replicas:
+		simulation.run(replica=i)
+	return simulation.boarding_time
+
+
+class JobServer:
+	def __init__(self, cache_dir=CACHE_DIR, n_workers=None, chunk_size=CHUNK_SIZE):
+		self.cache = result_cache.ResultCache(cache_dir)
+		self.executor = ProcessPoolExecutor(max_workers=n_workers)
+		self.chunk_size = chunk_size
+		self.jobs = OrderedDict()
+		self.running_chunks = {}     # (cache key, start) -> Chunk
+		self.lock = threading.Lock()
+
+	# Submits a batch of jobs, and returns their ids. All the jobs are validated before any of them is submitted.
+	def submit_batch(self, specs):
+		if not isinstance(specs, list):
+			raise ValueError('Jobs must be submitted as a list')
+		jobs = [validate_spec(spec) for spec in specs]
+		return [self.submit(config, seed, n) for config, seed, n in jobs]
+
+	# Submits a validated job (see validate_spec()), and returns its id.
+	# Raises RuntimeError if the job could not be started.
+	def submit(self, config, seed, n):
+		key = self.cache.make_key(config, seed)
+		job_id = f'{key}-{n}'
+		new_chunks = []
+		with self.lock:
+			job = self.jobs.get(job_id)
+			if job is not None and job.status != 'failed':
+				return job_id
+
+			job = Job(config=config, seed=seed, n=n)
+			self.jobs[job_id] = job
+			self.evict_finished_jobs()
+
+			cached = [int(t) for t in self.cache.load(key)]
+			job.chunks[0] = cached
+
+			# Chunks end at multiples of the chunk size, so that jobs with a different number of runs share them.
+			# The last chunk may go beyond `n` - the extra runs are saved in the cache.
+			start = len(cached)
+			while start < n:
+				chunk = self.running_chunks.get((key, start))
+				if chunk is None:
+					chunk = Chunk(end=(start // self.chunk_size + 1) * self.chunk_size)
+					self.running_chunks[(key, start)] = chunk
+					new_chunks.append((start, chunk.end))
+				chunk.jobs.append(job)
+				job.n_chunks += 1
+				start = chunk.end
+
+			if job.n_chunks == 0:
+				self.finish(job)
+
+		for ind, (start, end) in enumerate(new_chunks):
+			try:
+				future = self.executor.submit(run_replicas, config, seed, range(start, end))
+			except Exception as e:
+				# E.g. a broken process pool. Fail all the jobs waiting for the chunks that will never run.
+				for failed_start, _ in new_chunks[ind:]:
+					self.chunk_done(key, failed_start, error=repr(e))
+				raise RuntimeError(f'Could not start the job: {e!r}') from e
+			future.add_done_callback(lambda f, start=start: self.chunk_done(key, start, future=f))
+		return job_id
+
+	def chunk_done(self, key, start, future=None, error=None):
+		if future is not None and future.exception() is not None:
+			error = repr(future.exception())
+
+		with self.lock:
+			chunk = self.running_chunks.pop((key, start))
+			for job in chunk.jobs:
+				if job.status != 'running':
+					continue
+				if error is not None:
+					job.status = 'failed'
+					job.error = error
+					continue
+				job.chunks[start] = future.result()
+				job.chunks_done += 1
+				if job.chunks_done == job.n_chunks:
+					self.finish(job)
+
+	# Must be called with the lock held.
+	def finish(self, job):
+		boarding_time = [t for start in sorted(job.chunks) for t in job.chunks[start]]
+		job.boarding_time = boarding_time[:job.n]
+		job.chunks = {}
+		job.status = 'done'
+		self.cache.store(self.cache.make_key(job.config, job.seed), boarding_time)
+
+	# Must be called with the lock held.
+	def evict_finished_jobs(self):
+		finished = [job_id for job_id, job in self.jobs.items() if job.status != 'running']
+		for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+			self.jobs.pop(job_id)
+
+	def job_status(self, job_id):
+		with self.lock:
+			job = self.jobs.get(job_id)
+			return None if job is None else job.to_json()
+
+	def status(self):
+		with self.lock:
+			counts = {'running': 0, 'done': 0, 'failed': 0}
+			for job in self.jobs.values():
+				counts[job.status] += 1
+			return counts
+
+	def shutdown(self):
+		self.executor.shutdown(cancel_futures=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+	def send_json(self, code, body):
+		data = json.dumps(body).encode('utf-8')
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		job_server = self.server.job_server
+		if self.path == '/status':
+			self.send_json(200, job_server.status())
+		elif self.path.startswith('/jobs/'):
+			job = job_server.job_status(self.path[len('/jobs/'):])
+			if job is None:
+				self.send_json(404, {'error': 'Unknown job'})
+			else:
+				self.send_json(200, job)
+		else:
+			self.send_json(404, {'error': 'Not found'})
+
+	def do_POST(self):
+		if self.path != '/jobs':
+			self.send_json(404, {'error': 'Not found'})
+			return
+
+		try:
+			specs = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+			job_ids = self.server.job_server.submit_batch(specs)
+		except ValueError as e:
+			self.send_json(400, {'error': str(e)})
+			return
+		except RuntimeError as e:
+			self.send_json(500, {'error': str(e)})
+			return
+		self.send_json(200, {'job_ids': job_ids})
+
+	def log_message(self, format, *args):
+		pass
+
+
+def serve(host=HOST, port=PORT, cache_dir=CACHE_DIR, n_workers=None):
+	job_server = JobServer(cache_dir=cache_dir, n_workers=n_workers)
+	http_server = ThreadingHTTPServer((host, port), RequestHandler)
+	http_server.job_server = job_server
+	print(f'Serving on http://{host}:{port}')
+	try:
+		http_server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		http_server.server_close()
+		job_server.shutdown()
+
+
+if __name__ == '__main__':
+	serve()
@@ -1,38 +1,70 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import plane_boarding
+import result_cache
 import os
 
 
-OUTPUT_DIR = '~/plane_boarding'
+OUTPUT_DIR = os.path.expanduser('~/plane_boarding')
+CACHE_DIR = os.path.join(OUTPUT_DIR, 'cache')
 
+# Number of threads used to run the simulations. Use more than 1 only with free-threaded Python builds.
+N_THREADS = 1
+
+# Seed used for all the simulations. Together with the cache it makes re-running unchanged settings instant.
+SEED = 0
+
+
+# Saves runs as their seed and configuration only. Full history is regenerated (with Simulation.replay()) and saved
+# just for the first run, and for the runs in the `slowest_percentile` (if set).
+def save_history(simulation, n=1, slowest_percentile=None):
+	if simulation.seed is None:
+		raise ValueError('Saving runs requires a seed, so that their history can be regenerated')
 
-def save_history(simulation, n=1):
 	for passengers_proportion in [1.0]:
 		for boarding_zone in plane_boarding.BoardingZones:
 			simulation.set_boarding_zones(boarding_zone)
 			print(boarding_zone.name.lower())
-			for i in range(n):
-				simulation.run()
-				file_name = f'{boarding_zone.name.lower()}_{passengers_proportion}_{simulation.n_rows}_{simulation.n_seats_left}_history_{i}.txt'
-				simulation.serialize_history(os.path.join(OUTPUT_DIR, file_name))
+			simulation.run_multiple(n)
+
+			file_prefix = f'{boarding_zone.name.lower()}_{passengers_proportion}_{simulation.n_rows}_{simulation.n_seats_left}'
+			config = simulation.get_config()
+			with open(os.path.join(OUTPUT_DIR, f'{file_prefix}_runs.json'), 'w') as file:
+				json.dump({'seed': simulation.seed, 'config': config, 'boarding_time': simulation.boarding_time}, file)
+
+			replicas = {0}
+			if slowest_percentile is not None:
+				threshold = np.percentile(simulation.boarding_time, 100 - slowest_percentile)
+				replicas.update(i for i, t in enumerate(simulation.boarding_time) if t >= threshold)
+
+			for i in sorted(replicas):
+				replay = plane_boarding.Simulation.replay(simulation.seed, config, replica=i)
+				replay.serialize_history(os.path.join(OUTPUT_DIR, f'{file_prefix}_history_{i}.txt'))
 			break
 
-def measure_boarding_time(simulation, n=10):
+# With `n_threads` > 1 all boarding methods are simulated concurrently, each by its own clone of `simulation`.
+def measure_boarding_time(simulation, n=10, n_threads=1):
 	for passengers_proportion in [0.8, 1.0]:
 		print('')
+		simulations = []
 		for boarding_zone in plane_boarding.BoardingZones:
-			simulation.set_passengers_proportion(passengers_proportion)
-			simulation.set_boarding_zones(boarding_zone)
-			simulation.run_multiple(n)
+			simulations.append(simulation.clone())
+			simulations[-1].set_passengers_proportion(passengers_proportion)
+			simulations[-1].set_boarding_zones(boarding_zone)
+
+		with ThreadPoolExecutor(max_workers=n_threads) as executor:
+			list(executor.map(lambda s: s.run_multiple(n), simulations))
 
-			print(boarding_zone, passengers_proportion, np.mean(simulation.boarding_time))
+		for boarding_zone, method_simulation in zip(plane_boarding.BoardingZones, simulations):
+			print(boarding_zone, passengers_proportion, np.mean(method_simulation.boarding_time))
 			
 			file_name = f'{boarding_zone.name.lower()}_{passengers_proportion}'
 			full_path = os.path.join(OUTPUT_DIR, f'{file_name}_{simulation.n_rows}_{simulation.n_seats_left}_total_time.txt')
 
 			with open(full_path, "w") as file:
 				file.write(f'{boarding_zone.name.lower()} {passengers_proportion}\n')
-				file.write(' '.join(map(str, simulation.boarding_time)))
+				file.write(' '.join(map(str, method_simulation.boarding_time)))
 
 
 def save_boarding_orders(simulation):
@@ -59,10 +91,12 @@ def main():
 	simulation.set_custom_aircraft(n_rows=16, n_seats_left=3, n_seats_right=3)
 	simulation.set_passengers_proportion(1.0)
 	simulation.set_boarding_zones(plane_boarding.BoardingZones.RANDOM)
+	simulation.set_seed(SEED)
+	simulation.set_result_cache(result_cache.ResultCache(CACHE_DIR))
 
 	save_boarding_orders(simulation)
 	save_history(simulation, n=1)
-	measure_boarding_time(simulation, n=5)
+	measure_boarding_time(simulation, n=5, n_threads=N_THREADS)
 
 if __name__ == "__main__":
 	main()
\ No newline at end of file
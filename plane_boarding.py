@@ -1,4 +1,6 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import heapq
 from dataclasses import dataclass, field
 from enum import Enum, IntEnum
 
@@ -6,10 +8,15 @@ import numpy as np
 import itertools
 
 
+# Default speeds (time units per action). Every simulation has its own copy, see Simulation.set_speeds().
 SPEED_MOVE = 2
 SPEED_SEATING = 3
 SPEED_STOW_BAGGAGE = 3
 
+# Version of the simulation engine. It is a part of the result cache key, so it must be bumped whenever
+# a change to the simulation may alter the results.
+ENGINE_VERSION = 1
+
 class State(IntEnum):
 	UNDEFINED = 0
 	BOARDING_QUEUE = 1
@@ -61,7 +68,7 @@ class Passenger:
 
 	
 class Simulation:
-	def __init__(self, dummy_rows=2, quiet_mode = True):
+	def __init__(self, dummy_rows=2, quiet_mode = True, keep_history=False):
 		self.dummy_rows = dummy_rows       # We add dummy rows to have some space before the actual seats appear.
 		self.passengers = []
 		self.t = 0
@@ -70,6 +77,18 @@ class Simulation:
 		self.row_vacating = {}
 		self.boarding_zones = BoardingZones.RANDOM
 		self.quiet_mode = quiet_mode
+		self.speed_move = SPEED_MOVE
+		self.speed_seating = SPEED_SEATING
+		self.speed_stow_baggage = SPEED_STOW_BAGGAGE
+		self.seed = None
+		self.rng = np.random.default_rng()
+		self.result_cache = None
+		# History is needed for animations, but slows down the simulation. As every run is determined by the configuration
+		# and the seed, it is by default not recorded, and can be regenerated later with Simulation.replay().
+		self.keep_history = keep_history
+		self.history_window = None         # If set, only history entries with history_window[0] <= t < history_window[1] are kept.
+		self.history_passengers = None     # If set, only history of these passengers is kept.
+		self.collectors = []
 		self.reset_stats()
 
 	def set_custom_aircraft(self, n_rows, n_seats_left=2, n_seats_right=2):
@@ -87,6 +106,75 @@ class Simulation:
 	def set_boarding_zones(self, boarding_zones):
 		self.boarding_zones = boarding_zones
 
+	def set_speeds(self, move=SPEED_MOVE, seating=SPEED_SEATING, stow_baggage=SPEED_STOW_BAGGAGE):
+		self.speed_move = move
+		self.speed_seating = seating
+		self.speed_stow_baggage = stow_baggage
+
+	# With a seed set, every run is reproducible: replica `i` of run_multiple() always uses the same random stream.
+	def set_seed(self, seed):
+		self.seed = seed
+		self.rng = np.random.default_rng(seed)
+
+	# Results of run_multiple() will be reused from (and saved to) the cache. Requires a seed to be set.
+	# Cached results are not reused while collectors are attached, as they must observe every run.
+	def set_result_cache(self, result_cache):
+		self.result_cache = result_cache
+
+	# Creates a simulation from a configuration returned by get_config().
+	@classmethod
+	def from_config(cls, config, **kwargs):
+		if config['engine_version'] != ENGINE_VERSION:
+			raise ValueError(f'Configuration is from engine version {config["engine_version"]}, current version is {ENGINE_VERSION}')
+		simulation = cls(dummy_rows=config['dummy_rows'], **kwargs)
+		simulation.set_custom_aircraft(config['n_rows'], config['n_seats_left'], config['n_seats_right'])
+		simulation.set_passengers_number(config['n_passengers'])
+		simulation.set_boarding_zones(BoardingZones[config['boarding_zones']])
+		simulation.set_speeds(config['speed_move'], config['speed_seating'], config['speed_stow_baggage'])
+		return simulation
+
+	# Creates an independent simulation with the same configuration, seed and result cache (but without collectors).
+	def clone(self):
+		simulation = Simulation.from_config(self.get_config(), quiet_mode=self.quiet_mode, keep_history=self.keep_history)
+		simulation.set_seed(self.seed)
+		simulation.set_result_cache(self.result_cache)
+		return simulation
+
+	# Regenerates a run with its history. A run is fully determined by the configuration (see get_config()),
+	# the seed and the replica number (see run()).
+	# History can be restricted to a time window [start, end) and/or to a set of passengers (1-indexed, in the boarding
+	# order). The simulation is stopped at the end of the time window. History restricted to a time window can't be saved
+	# with serialize_history(), as it doesn't start with boarding.
+	@classmethod
+	def replay(cls, seed, config, replica=0, time_window=None, passengers=None):
+		if seed is None:
+			raise ValueError('Only runs with a seed can be replayed')
+		simulation = cls.from_config(config, keep_history=True)
+		simulation.set_seed(seed)
+		simulation.history_window = time_window
+		simulation.history_passengers = None if passengers is None else set(passengers)
+		simulation.run(replica=replica, t_max=None if time_window is None else time_window[1])
+		return simulation
+
+	# Everything that determines the simulation results (apart from the seed).
+	def get_config(self):
+		return {
+			'n_rows': self.n_rows,
+			'n_seats_left': self.n_seats_left,
+			'n_seats_right': self.n_seats_right,
+			'dummy_rows': self.dummy_rows,
+			'n_passengers': self.n_passengers,
+			'boarding_zones': self.boarding_zones.name,
+			'speed_move': self.speed_move,
+			'speed_seating': self.speed_seating,
+			'speed_stow_baggage': self.speed_stow_baggage,
+			'engine_version': ENGINE_VERSION,
+		}
+
+	# Collectors gather statistics incrementally during the runs, see collectors.py.
+	def add_collector(self, collector):
+		self.collectors.append(collector)
+
 	def reset_stats(self):
 		self.boarding_time = []
 
@@ -120,6 +208,20 @@ class Simulation:
 
 		self.randomize_passengers()
 
+		# Instead of checking every passenger at every step, step() only processes passengers scheduled for the current
+		# time. `events` is a heap of (time, passenger id), and `scheduled_t[pid]` is the time passenger is scheduled
+		# for (older entries in the heap are ignored).
+		# Passengers blocked in the aisle are not scheduled at all - `aisle_waiting[row]` is the passenger waiting for the
+		# aisle in `row` to be free (row 0 is awaited by the first passenger in the boarding queue), who is woken up
+		# once it's freed.
+		self.events = []
+		self.scheduled_t = [None] * len(self.passengers)
+		self.aisle_waiting = {}
+		self.current_pid = 0            # Passenger being processed by step()
+		self.seated_count = 0
+		if self.n_passengers > 0:
+			self.schedule(1, 0)
+
 	def randomize_passengers(self):
 		seat_cols = set(range(-self.n_seats_left, self.n_seats_right+1)) - {0}   # Possible seats
 		seat_rows = range(self.dummy_rows, self.n_rows+self.dummy_rows)          # Possible rows
@@ -130,7 +232,7 @@ class Simulation:
 		# 2. Randomly select seat indices for every passenger
 		# 3. Create seat's list (i-th seat corresponds to the )
 		all_seats = list(list(x) for x in itertools.product(seat_rows, seat_cols, [0]))
-		selected_seats_ind = np.random.choice(len(all_seats), size=self.n_passengers, replace=False)
+		selected_seats_ind = self.rng.choice(len(all_seats), size=self.n_passengers, replace=False)
 		selected_seats = [all_seats[seat_ind] for seat_ind in selected_seats_ind]
 
 		# Here we iterate over all seats and set the correct boarding zone.
@@ -243,10 +345,11 @@ class Simulation:
 
 		def process_passenger(pid, passengers):
 			p = self.passengers[pid]
-			p.state = State.VACATING_ROW
-			time_to_vacate = abs(p.seat) * SPEED_SEATING
+			self.set_state(pid, State.VACATING_ROW)
+			time_to_vacate = abs(p.seat) * self.speed_seating
 			p.next_action_t = self.t + time_to_vacate
-			self.history[pid].append([self.t, p.x, p.y, int(State.VACATING_ROW)])
+			self.schedule(pid, p.next_action_t)
+			self.record_history(pid, [self.t, p.x, p.y, int(State.VACATING_ROW)])
 			passengers.append(pid)
 			return time_to_vacate
 			
@@ -264,37 +367,147 @@ class Simulation:
 		passengers.append(new_passenger_id)
 		vacate_entry = RowVacating(passengers=passengers, next_action_t=self.t+waiting_time)
 		self.row_vacating[row] = vacate_entry
+		for collector in self.collectors:
+			collector.on_row_vacating(self, row, passengers)
 		return waiting_time
 
+	# Changes passenger's state. All state changes should go through here, so that the collectors are notified.
+	def set_state(self, pid, state):
+		p = self.passengers[pid]
+		for collector in self.collectors:
+			collector.on_state_change(self, pid, p.state, state)
+		if p.state == State.SEATED:
+			self.seated_count -= 1
+		if state == State.SEATED:
+			self.seated_count += 1
+		p.state = state
+
+	# Schedules passenger to be processed by step() at time `t`.
+	# A passenger due in this step is processed in this step only if not processed yet, otherwise in the next one
+	# (exactly as if all the passengers were checked in order at every step).
+	def schedule(self, pid, t):
+		pid = int(pid)
+		if t <= self.t and pid <= self.current_pid:
+			t = self.t+1
+		if self.scheduled_t[pid] == t:
+			return
+		self.scheduled_t[pid] = t
+		heapq.heappush(self.events, (t, pid))
+
+	# Is the aisle in a given row free to enter?
+	def is_aisle_free(self, row):
+		return self.aisle[row] == 0 and row not in self.row_vacating
+
+	# Marks the aisle in a given row as empty, and wakes up the passenger waiting for it.
+	def clear_aisle(self, row):
+		self.aisle[row] = 0
+		pid = self.aisle_waiting.pop(row, None)
+		if pid is not None:
+			self.schedule(pid, self.t)
+
+	def record_history(self, pid, entry):
+		if not self.keep_history:
+			return
+		if self.history_passengers is not None and pid not in self.history_passengers:
+			return
+		if self.history_window is not None and not self.history_window[0] <= self.t < self.history_window[1]:
+			return
+		self.history[pid].append(entry)
+
+	def record_baggage(self, pid, entry):
+		if not self.keep_history:
+			return
+		if self.history_passengers is not None and pid not in self.history_passengers:
+			return
+		if self.history_window is not None and not self.history_window[0] <= self.t < self.history_window[1]:
+			return
+		self.history_baggage.append(entry)
+
 	def print_info(self, *args):
 		if not self.quiet_mode:
 			print(*args)
 
 	# Run multiple simulations
-	def run_multiple(self, n):
+	# With `n_threads` > 1 the runs are split between threads (see run_threaded()).
+	def run_multiple(self, n, n_threads=1):
 		self.reset_stats()
-		for i in range(n):
-			self.run()
+
+		# Reuse the cached replicas, and simulate only the missing ones.
+		# Collectors need to see every run, so with collectors attached all the replicas are simulated (and the cache
+		# is only updated).
+		key = None
+		if self.result_cache is not None and self.seed is not None:
+			key = self.result_cache.make_key(self.get_config(), self.seed)
+			if not self.collectors:
+				self.boarding_time = [int(t) for t in self.result_cache.load(key)[:n]]
+		n_cached = len(self.boarding_time)
+
+		if n_threads > 1 and n - n_cached > 1:
+			self.boarding_time += self.run_threaded(range(n_cached, n), n_threads)
+		else:
+			for i in range(n_cached, n):
+				self.run(replica=i)
+
+		if key is not None and n > n_cached:
+			# Only stores the times if they extend the cached ones.
+			self.result_cache.store(key, self.boarding_time)
+
+	# Runs given replicas on a thread pool, and returns their boarding times.
+	# Every thread runs its own clone of the simulation, as simulations share no state, and collectors' results are
+	# merged at the end. Threads avoid the startup and pickling overhead of processes, but they only run in parallel on
+	# free-threaded Python builds.
+	def run_threaded(self, replicas, n_threads):
+		def run_chunk(chunk):
+			simulation = self.clone()
+			simulation.collectors = [collector.empty_copy() for collector in self.collectors]
+			for i in chunk:
+				simulation.run(replica=i)
+			return simulation
+
+		chunks = [replicas[i::n_threads] for i in range(n_threads)]
+		with ThreadPoolExecutor(max_workers=n_threads) as executor:
+			simulations = list(executor.map(run_chunk, chunks))
+
+		boarding_time = [0] * len(replicas)
+		for i, simulation in enumerate(simulations):
+			boarding_time[i::n_threads] = simulation.boarding_time
+			for collector, other in zip(self.collectors, simulation.collectors):
+				collector.merge(other)
+		return boarding_time
 
 	# Run a single simulation
-	def run(self):
+	# If the seed is set, the passengers are drawn from a random stream determined by the seed and `replica`.
+	# If `t_max` is set, the simulation is stopped at that time (unfinished runs are not added to the stats).
+	def run(self, replica=0, t_max=None):
+		if self.seed is not None:
+			self.rng = np.random.default_rng([self.seed, replica])
 		self.reset()
+		for collector in self.collectors:
+			collector.on_run_start(self)
+
 		while True:
 			self.print_info(f'\n*** Step {self.t}')
 			finished = self.step()
+			for collector in self.collectors:
+				collector.on_step(self)
 			if not self.quiet_mode:
 				self.print()
 
 			if finished:
 				break
 			self.t += 1
+			if t_max is not None and self.t >= t_max:
+				return
 		
 		# Update stats
 		self.boarding_time.append(self.t)
+		for collector in self.collectors:
+			collector.on_run_end(self)
 
 	# Process a single animation step.
 	def step(self):
 		# First processed rows that are vacated.
+		self.current_pid = 0
 		vacating_finished = []
 		for row, entry in self.row_vacating.items():
 			if entry.next_action_t > self.t: continue
@@ -302,57 +515,65 @@ class Simulation:
 			if len(entry.passengers) > 0:
 				# If there are still passengers waiting, make the next in line to seat.
 				pid = entry.passengers[-1]
-				self.passengers[pid].state = State.SEATING
-				self.passengers[pid].next_action_t = self.t + SPEED_SEATING
-				self.history[pid].append([self.t, 0, row, int(State.VACATING_ROW)])
+				self.set_state(pid, State.SEATING)
+				self.passengers[pid].next_action_t = self.t + self.speed_seating
+				self.schedule(pid, self.passengers[pid].next_action_t)
+				self.record_history(pid, [self.t, 0, row, int(State.VACATING_ROW)])
 
-				entry.next_action_t = self.t + SPEED_SEATING
+				entry.next_action_t = self.t + self.speed_seating
 				entry.passengers.pop()
 			else:
 				# No more passengers, so mark as completed.
 				vacating_finished.append(row)
 		
-		# Clean vacated rows: mark the aisle as empty in that row, and remove row vacating structure. 
+		# Clean vacated rows: remove row vacating structure, and mark the aisle as empty in that row.
 		for row in vacating_finished:
-			self.aisle[row] = 0
 			self.row_vacating.pop(row)
+			self.clear_aisle(row)
 
-		# Process passengers.
-		# This basically iterates over all the passengers, and performs appropriate actions based on their state.
-		seated_count = 0   # Number of passengers already seated.
-		for i, p in enumerate(self.passengers):
-			if i == 0: continue
+		# Everyone was already seated before this step.
+		if self.seated_count == self.n_passengers:
+			return True
 
-			# To speed simulations we keep track of the `next_action_t` - a time when a given passenger may do the next action.
-			# E.g. if walking takes 10 units of time, and a given passenger just started to walk, then we don't need to do anything
-			# for him for the next 9 units of time.
-			if p.next_action_t > self.t: continue
+		# Process passengers scheduled for this step, in the order of boarding.
+		while self.events and self.events[0][0] <= self.t:
+			t, i = heapq.heappop(self.events)
+			if self.scheduled_t[i] != t:
+				continue
+			self.scheduled_t[i] = None
+			self.current_pid = i
+			p = self.passengers[i]
 
 			match p.state:
 				case State.BOARDING_QUEUE:
-					# If the first space in the aisle is empty, move there.
-					if self.aisle[0] == 0:
-						self.aisle[0] = i
-						p.state = State.MOVE_WAIT
-						p.x = 0
-						p.y = 0
-						p.next_action_t = self.t + 1
-						self.history[i].append([self.t, 0, 0, int(State.BOARDING_QUEUE)])
-					
-					# All the following passengers must also be in the queue.
-					break
+					# If the first space in the aisle is empty, move there. Otherwise wait until it's freed.
+					if self.aisle[0] != 0:
+						self.aisle_waiting[0] = i
+						continue
+
+					self.aisle[0] = i
+					self.set_state(i, State.MOVE_WAIT)
+					p.x = 0
+					p.y = 0
+					p.next_action_t = self.t + 1
+					self.record_history(i, [self.t, 0, 0, int(State.BOARDING_QUEUE)])
+
+					# The next passenger in the queue may board in the next step.
+					if i < self.n_passengers:
+						self.schedule(i+1, self.t+1)
 
 				case State.MOVE_WAIT:
 					# Check if the next row is empty.
-					if self.aisle[p.y+1] != 0 or p.y+1 in self.row_vacating:
+					if not self.is_aisle_free(p.y+1):
+						self.aisle_waiting[p.y+1] = i
 						continue
 					
 					# We can go!
-					p.next_action_t = self.t + SPEED_MOVE
-					p.state = State.MOVE_TO_ROW
-					self.history[i].append([self.t, 0, p.y, int(p.state)])
+					p.next_action_t = self.t + self.speed_move
+					self.set_state(i, State.MOVE_TO_ROW)
+					self.record_history(i, [self.t, 0, p.y, int(p.state)])
 
-					self.aisle[p.y] = 0
+					self.clear_aisle(p.y)
 					p.y += 1
 					self.aisle[p.y] = i
 
@@ -362,50 +583,51 @@ class Simulation:
 					if p.y == p.seat_row:
 						# Did we reach the seat?
 						if p.has_baggage:
-							p.state = State.STOW_BAGGAGE
-							p.next_action_t = self.t + SPEED_STOW_BAGGAGE
-							self.history[i].append([self.t, 0, p.y, int(p.state)])
+							self.set_state(i, State.STOW_BAGGAGE)
+							p.next_action_t = self.t + self.speed_stow_baggage
+							self.record_history(i, [self.t, 0, p.y, int(p.state)])
 						else:
 							if self.is_seat_accessible(row=p.seat_row, seat=p.seat):
-								p.state = State.SEATING
-								p.next_action_t = self.t + SPEED_SEATING
+								self.set_state(i, State.SEATING)
+								p.next_action_t = self.t + self.speed_seating
 							else:
 								waiting_time = self.vacate_row(i, p.seat_row, p.seat)
-								p.state = State.WAIT_TO_SEAT
+								self.set_state(i, State.WAIT_TO_SEAT)
 								p.next_action_t = self.t + waiting_time
-							self.history[i].append([self.t, 0, p.y, int(p.state)])
+							self.record_history(i, [self.t, 0, p.y, int(p.state)])
 					else:
 						# We still need to reach our row.
-						if self.aisle[p.y+1] != 0 or p.y+1 in self.row_vacating:
-							p.state = State.MOVE_WAIT
-							self.history[i].append([self.t, 0, p.y, int(p.state)])
+						if not self.is_aisle_free(p.y+1):
+							self.set_state(i, State.MOVE_WAIT)
+							self.record_history(i, [self.t, 0, p.y, int(p.state)])
+							self.aisle_waiting[p.y+1] = i
 							continue
 
-						p.next_action_t = self.t + SPEED_MOVE
-						self.history[i].append([self.t, 0, p.y, int(p.state)])
+						p.next_action_t = self.t + self.speed_move
+						self.record_history(i, [self.t, 0, p.y, int(p.state)])
 
-						self.aisle[p.y] = 0
+						self.clear_aisle(p.y)
 						p.y += 1
 						self.aisle[p.y] = i
 
 				case State.STOW_BAGGAGE:
 					ind = 0 if p.seat < 0 else 1
 					self.baggage_bin[p.seat_row][ind] += 1
-					self.history_baggage.append([self.t, p.seat_row, ind])
+					self.record_baggage(i, [self.t, p.seat_row, ind])
 
 					if self.is_seat_accessible(row=p.seat_row, seat=p.seat):
-						p.state = State.SEATING
-						p.next_action_t = self.t + SPEED_SEATING
+						self.set_state(i, State.SEATING)
+						p.next_action_t = self.t + self.speed_seating
 					else:
 						waiting_time = self.vacate_row(i, p.seat_row, p.seat)
-						p.state = State.WAIT_TO_SEAT
+						self.set_state(i, State.WAIT_TO_SEAT)
 						p.next_action_t = self.t + waiting_time
-					self.history[i].append([self.t, 0, p.y, int(p.state)])
+					self.record_history(i, [self.t, 0, p.y, int(p.state)])
 
 
 				case State.VACATING_ROW:
 					p.x = 0
-					self.history[i].append([self.t, p.x, p.y, int(State.VACATING_ROW)])
+					self.record_history(i, [self.t, p.x, p.y, int(State.VACATING_ROW)])
 					
 				case State.RESEATING:
 					# This state is handled by self.row_vacating at the beginning of the function.
@@ -418,7 +640,7 @@ class Simulation:
 				case State.SEATING:
 					# If we moved from the aisle, mark it as empty.
 					if p.x == 0 and p.y not in self.row_vacating:
-						self.aisle[p.y] = 0
+						self.clear_aisle(p.y)
 
 					# Move to the next seat.
 					if p.seat > 0:
@@ -428,34 +650,49 @@ class Simulation:
 
 					# Did we reach our seat?
 					if p.x == p.seat:
-						p.state = State.SEATED
+						self.set_state(i, State.SEATED)
 						if p.seat > 0:
 							self.side_right[p.y, p.seat-1] = i
 						else:
 							self.side_left[p.y, -p.seat-1] = i
 					else:
-						p.next_action_t = self.t + SPEED_SEATING
-
-					self.history[i].append([self.t, p.x, p.y, int(p.state)])
+						p.next_action_t = self.t + self.speed_seating
 
-				case State.SEATED:
-					seated_count += 1
+					self.record_history(i, [self.t, p.x, p.y, int(p.state)])
 
 				case _:
 					self.print_info(f'State {p.state} is not handled.')
 
-		# Check whether everyone is already seated
-		return seated_count == self.n_passengers
+			# To speed simulations we keep track of the `next_action_t` - a time when a given passenger may do the next action.
+			# E.g. if walking takes 10 units of time, and a given passenger just started to walk, then we don't need to do anything
+			# for him for the next 9 units of time.
+			# Passengers whose action is already due (e.g. with a zero speed, or vacating a row) are processed again in
+			# the next step. Passengers waiting to seat are scheduled by self.row_vacating, and the seated ones are done.
+			if p.state not in (State.SEATED, State.WAIT_TO_SEAT, State.RESEATING):
+				self.schedule(i, p.next_action_t)
+
+		# Nobody is scheduled, and no row is being vacated, so nothing will ever change.
+		if not self.events and not self.row_vacating and self.seated_count < self.n_passengers:
+			raise RuntimeError(f'Simulation stalled at step {self.t} with {self.n_passengers - self.seated_count} passengers not seated')
+
+		return False
 			
 	# Save boarding history to a file.
 	def serialize_history(self, path):
+		if not self.keep_history:
+			raise ValueError('History was not recorded, use keep_history=True or Simulation.replay()')
+		if self.history_window is not None:
+			raise ValueError('History restricted to a time window can not be saved, as it does not start with boarding')
+
 		with open(path, 'w') as f:
 			# General parameters in the header.
 			f.write(f'{self.n_rows} {self.dummy_rows} {self.n_seats_left} {self.n_seats_right} {self.n_passengers} {len(self.history_baggage)}\n')
 
-			# Save passengers' history.
-			for id, h in self.history.items():
-				f.write(f'{len(h)}\n')
+			# Save passengers' history, in the boarding order. Every history starts with the passenger id and the number
+			# of entries, which is 0 for passengers not recorded (see Simulation.replay()).
+			for pid in range(1, self.n_passengers+1):
+				h = self.history.get(pid, [])
+				f.write(f'{pid} {len(h)}\n')
 				for entry in h:
 					f.write(' '.join(map(str, entry)) + '\n')
 
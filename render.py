@@ -0,0 +1,268 @@
+# Headless alternative to animate.py: renders simulation histories (see Simulation.serialize_history()) to GIFs
+# or videos, without Processing. Frames are rendered in parallel, in separate processes.
+#
+# Requires Pillow. Videos other than GIFs are encoded with ffmpeg, which must be available in PATH.
+
+import colorsys
+import glob
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+
+MAIN_PATH = '~/plane_boarding'          # Directory with the outputs of main.py
+OUTPUT_MOVIE_DIR = os.path.join(MAIN_PATH, 'movies')
+
+N_ROWS = 16
+N_SEATS = 3
+PASSENGERS_PROPORTION = 1.0
+
+# How many frames per each simulation step. The higher the number, the slower the animation.
+FRAMES_PER_STEP = 8
+FPS = 30
+
+WIDTH = 1280
+HEIGHT = 720
+
+TOP_Y = 40                                  # We will start drawing at this Y position
+
+CELL_SIZE = 36                              # Size of the cell
+CORRIDOR_WIDTH_HALF = CELL_SIZE / 2         # 1/2 of the corridor width
+
+# Seat is slightly smaller than a cell, so that they won't overlap with each other
+SEAT_MARGIN = 2                             # Seat padding
+SEAT_SIZE = CELL_SIZE - SEAT_MARGIN * 2     # Seat size
+
+PASSENGER_RADIUS = 10
+
+# Size and spacing between legend boxes.
+LEGEND_BOX_SIZE = 18
+LEGEND_BOX_MARGIN = 8
+
+# Colors and labels are the same as in animate.py.
+STATE_TO_COLOR = {
+    1: (255, 255, 255),
+    2: (255, 133, 133),
+    3: (190, 236, 182),
+    4: (116, 183, 250),
+    5: (239, 144, 42),
+    6: (190, 236, 182),
+    7: (190, 236, 182),
+    8: (190, 236, 182),
+    9: (124, 201, 30),
+}
+
+STATE_TO_LABEL = {
+    2: 'Waiting',
+    3: 'Moving',
+    4: 'Stowing baggage',
+    5: 'Waiting to seat',
+    9: 'Seated',
+}
+
+
+class Trace:
+    def __init__(self, path):
+        with open(os.path.expanduser(path)) as f:
+            lines = iter(f)
+            self.n_rows, self.n_dummy_rows, self.n_seats_left, self.n_seats_right, self.n_passengers, n_baggage = map(int, next(lines).split())
+
+            # Every passenger's history is an array of [step, x, y, state] rows, in the boarding order. Histories of
+            # passengers not recorded are empty.
+            self.passengers = []
+            for i in range(self.n_passengers):
+                pid, n_entries = map(int, next(lines).split())
+                self.passengers.append(np.array([list(map(int, next(lines).split())) for j in range(n_entries)]).reshape(-1, 4))
+
+            self.baggage = [list(map(int, next(lines).split())) for i in range(n_baggage)]
+
+        self.n_steps = max((h[-1, 0] for h in self.passengers if len(h)), default=0) + 1
+
+
+# Boarding order is a list of lists, i-th element represents i-th row (-1 marks the aisle).
+def read_boarding_order(path):
+    with open(os.path.expanduser(path)) as f:
+        return [list(map(int, map(float, line.split()))) for line in f if line.strip()]
+
+
+def load_font(size):
+    try:
+        return ImageFont.truetype('DejaVuSans.ttf', size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+# Fonts used by render_frame(), by size.
+def load_fonts():
+    return {size: load_font(size) for size in [18, 22, 28, LEGEND_BOX_SIZE]}
+
+
+# State of all passengers at (possibly fractional) simulation time `t`.
+# Returns a list of (x, y, state) for passengers already on board, and the number of passengers in the queue.
+def passengers_at(trace, t):
+    positions = []
+    passengers_in_queue = 0
+    for h in trace.passengers:
+        if len(h) == 0:
+            continue
+        # Same as in animate.py: a passenger is in the queue until their second history entry.
+        if len(h) < 2 or t < h[1, 0]:
+            passengers_in_queue += 1
+            continue
+        ind = np.searchsorted(h[:, 0], t, side='right') - 1
+        x = np.interp(t, h[:, 0], h[:, 1])
+        y = np.interp(t, h[:, 0], h[:, 2])
+        positions.append((x, y, h[ind, 3]))
+    return positions, passengers_in_queue
+
+
+def draw_legend(draw, x, y, font):
+    for ind, state in enumerate(sorted(STATE_TO_LABEL), start=1):
+        pos_y = y + (LEGEND_BOX_SIZE + LEGEND_BOX_MARGIN) * ind
+        draw.rectangle([x, pos_y, x + LEGEND_BOX_SIZE, pos_y + LEGEND_BOX_SIZE], fill=STATE_TO_COLOR[state], outline=(64, 64, 64))
+        draw.text((x + LEGEND_BOX_SIZE + 10, pos_y + LEGEND_BOX_SIZE - 3), STATE_TO_LABEL[state], fill=(0, 0, 0), font=font, anchor='ls')
+
+
+def draw_plane_side(draw, trace, x, y, cols):
+    # We don't draw seats for dummy rows
+    for r in range(trace.n_dummy_rows, trace.n_rows + trace.n_dummy_rows):
+        for c in range(cols):
+            left = x + c * CELL_SIZE + SEAT_MARGIN
+            top = y + r * CELL_SIZE + SEAT_MARGIN
+            draw.rectangle([left, top, left + SEAT_SIZE, top + SEAT_SIZE], outline=(64, 64, 64))
+
+
+def draw_boarding_order(draw, boarding_order, x, y):
+    bin_size = 12
+    margin = 4
+    boarding_order_max = max((max(row) for row in boarding_order), default=0)
+    for r, row in enumerate(boarding_order):
+        for c, order in enumerate(row):
+            if order == -1:
+                continue
+            # Gradient from red (last to board) to green (first to board), as lerpColor() in HSB mode.
+            amount = 1.0 * order / boarding_order_max if boarding_order_max else 1.0
+            color = tuple(int(255 * v) for v in colorsys.hsv_to_rgb(amount * 120 / 360, 0.7, 0.9))
+            left = x + c * (bin_size + margin)
+            top = y + r * (bin_size + margin)
+            draw.rectangle([left, top, left + bin_size, top + bin_size], fill=color, outline=(0, 0, 0))
+
+
+# `fonts` are loaded with load_fonts(). Pass them when rendering many frames, as loading them is relatively slow.
+def render_frame(trace, boarding_order, frame, label='', mean_time=None, frames_per_step=FRAMES_PER_STEP, fonts=None):
+    if fonts is None:
+        fonts = load_fonts()
+    t = frame / frames_per_step
+    image = Image.new('RGB', (WIDTH, HEIGHT), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+
+    # Labels
+    draw.text((50, 70), label, fill=(0, 0, 0), font=fonts[28], anchor='ls')
+    if mean_time is not None:
+        draw.text((50, 100), f'Average time: {mean_time:.1f}', fill=(0, 0, 0), font=fonts[22], anchor='ls')
+
+    # Boarding order map
+    draw.text((196, 180), 'Boarding zones', fill=(0, 0, 0), font=fonts[18], anchor='ls')
+    draw_boarding_order(draw, boarding_order, 200, 200)
+
+    # Seats
+    posx = 0.5 * WIDTH
+    draw_plane_side(draw, trace, posx + CORRIDOR_WIDTH_HALF, TOP_Y, trace.n_seats_right)
+    draw_plane_side(draw, trace, posx - CORRIDOR_WIDTH_HALF - CELL_SIZE * trace.n_seats_left, TOP_Y, trace.n_seats_left)
+
+    # Passengers
+    positions, passengers_in_queue = passengers_at(trace, t)
+    for x, y, state in positions:
+        cx = posx + x * CELL_SIZE
+        cy = TOP_Y + CELL_SIZE / 2 + y * CELL_SIZE
+        draw.ellipse([cx - PASSENGER_RADIUS, cy - PASSENGER_RADIUS, cx + PASSENGER_RADIUS, cy + PASSENGER_RADIUS], fill=STATE_TO_COLOR[state], outline=(64, 64, 64))
+
+    # Legend
+    draw_legend(draw, 0.7 * WIDTH, 200, fonts[LEGEND_BOX_SIZE])
+
+    # Stats
+    n_recorded = sum(1 for h in trace.passengers if len(h))
+    completion = 100.0 * sum(1 for _, _, state in positions if state == 9) / max(1, n_recorded)
+    font = fonts[18]
+    draw.text((posx, TOP_Y - 20), f'Passengers in the queue: {passengers_in_queue}', fill=(0, 0, 0), font=font, anchor='ls')
+    draw.text((posx + 270, TOP_Y - 20), f'Time: {int(t)}', fill=(0, 0, 0), font=font, anchor='ls')
+    draw.text((posx + 400, TOP_Y - 20), f'Completion: {completion:.1f}%', fill=(0, 0, 0), font=font, anchor='ls')
+    return image
+
+
+# Every worker process reads the trace and loads the fonts once, instead of for every frame.
+_worker_args = None
+
+def _init_worker(history_path, boarding_order_path, label, mean_time, frames_per_step, frames_dir):
+    global _worker_args
+    _worker_args = (Trace(history_path), read_boarding_order(boarding_order_path), label, mean_time, frames_per_step, frames_dir, load_fonts())
+
+
+def _render_frames(frames):
+    trace, boarding_order, label, mean_time, frames_per_step, frames_dir, fonts = _worker_args
+    for frame in frames:
+        image = render_frame(trace, boarding_order, frame, label, mean_time, frames_per_step, fonts)
+        image.save(os.path.join(frames_dir, f'frame-{frame:06d}.png'), compress_level=1)
+    return len(frames)
+
+
+# Renders a history file to `output_path`. The format is chosen by extension: '.gif' is written with Pillow,
+# anything else (e.g. '.mp4') with ffmpeg.
+# GIF frames are encoded serially in this process, which is much slower than rendering them (about 0.1s per frame),
+# so '.gif' is only practical with a low `frames_per_step` (e.g. 1).
+def render(history_path, boarding_order_path, output_path, label='', mean_time=None, frames_per_step=FRAMES_PER_STEP,
+           fps=FPS, workers=None, chunk_size=32):
+    output_path = os.path.expanduser(output_path)
+    n_frames = Trace(history_path).n_steps * frames_per_step
+    chunks = [range(i, min(i + chunk_size, n_frames)) for i in range(0, n_frames, chunk_size)]
+
+    with tempfile.TemporaryDirectory() as frames_dir:
+        init_args = (history_path, boarding_order_path, label, mean_time, frames_per_step, frames_dir)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+            for _ in executor.map(_render_frames, chunks):
+                pass
+
+        if output_path.endswith('.gif'):
+            frame_paths = sorted(glob.glob(os.path.join(frames_dir, 'frame-*.png')))
+            first = Image.open(frame_paths[0])
+            first.save(output_path, save_all=True, append_images=(Image.open(path) for path in frame_paths[1:]),
+                       duration=1000 / fps, loop=0)
+        else:
+            ffmpeg = shutil.which('ffmpeg')
+            if ffmpeg is None:
+                raise RuntimeError('ffmpeg is needed to write videos other than GIFs')
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps),
+                            '-i', os.path.join(frames_dir, 'frame-%06d.png'),
+                            '-c:v', 'libx264', '-pix_fmt', 'yuv420p', output_path], check=True)
+
+
+# Renders animations for all boarding methods with history saved by main.py.
+def main():
+    main_path = os.path.expanduser(MAIN_PATH)
+    output_dir = os.path.expanduser(OUTPUT_MOVIE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+
+    suffix = f'_{PASSENGERS_PROPORTION}_{N_ROWS}_{N_SEATS}_history_0.txt'
+    for history_path in sorted(glob.glob(os.path.join(main_path, '*' + suffix))):
+        method = os.path.basename(history_path)[:-len(suffix)]
+        boarding_order_path = os.path.join(main_path, f'{method}_{N_ROWS}_{N_SEATS}_boarding_order.txt')
+
+        mean_time = None
+        total_time_path = os.path.join(main_path, f'{method}_{PASSENGERS_PROPORTION}_{N_ROWS}_{N_SEATS}_total_time.txt')
+        if os.path.exists(total_time_path):
+            with open(total_time_path) as f:
+                f.readline()
+                mean_time = np.mean(list(map(int, f.readline().split())))
+
+        print(method)
+        label = method.replace('_', ' ').capitalize()
+        render(history_path, boarding_order_path, os.path.join(output_dir, method + '.mp4'), label=label, mean_time=mean_time)
+
+
+if __name__ == '__main__':
+    main()
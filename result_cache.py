@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+# On-disk cache of boarding times, used by Simulation.run_multiple().
+#
+# Every entry is keyed by a hash of the simulation configuration and the seed, and holds boarding times of
+# consecutive replicas (replica `i` is always simulated with the same random stream, see Simulation.run()).
+# Thanks to that a cached block of e.g. 1000 runs can be extended to 2000 by simulating only the missing ones.
+# The replica count is therefore not a part of the key - it is the length of the stored block.
+#
+# The total size of the cache is bounded, and the least recently used entries are evicted first.
+class ResultCache:
+	def __init__(self, path, max_bytes=64 * 1024 * 1024):
+		self.path = os.path.expanduser(path)
+		self.max_bytes = max_bytes
+		os.makedirs(self.path, exist_ok=True)
+
+	# Canonical hash of the configuration (see Simulation.get_config()) and the seed.
+	@staticmethod
+	def make_key(config, seed):
+		payload = json.dumps({'config': config, 'seed': seed}, sort_keys=True, separators=(',', ':'))
+		return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+	def entry_path(self, key):
+		return os.path.join(self.path, key + '.npy')
+
+	# Returns cached boarding times (possibly empty) for a given key.
+	def load(self, key):
+		path = self.entry_path(key)
+		try:
+			boarding_time = np.load(path)
+		except (FileNotFoundError, ValueError, OSError):
+			return np.zeros(0, dtype=np.int64)
+
+		# Mark the entry as recently used. It might have been just evicted by another process or thread.
+		try:
+			os.utime(path)
+		except FileNotFoundError:
+			pass
+		return boarding_time
+
+	# Saves boarding times for a given key. An existing entry is only replaced by a longer one.
+	def store(self, key, boarding_time):
+		boarding_time = np.asarray(boarding_time, dtype=np.int64)
+		if len(boarding_time) <= len(self.load(key)):
+			return
+
+		# Write to a temporary file first, so that a reader never sees a partially written entry.
+		path = self.entry_path(key)
+		tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+		with open(tmp_path, 'wb') as f:
+			np.save(f, boarding_time)
+		os.replace(tmp_path, path)
+
+		self.evict()
+
+	# Removes the least recently used entries until the cache fits in `max_bytes`.
+	def evict(self):
+		entries = []
+		for name in os.listdir(self.path):
+			if not name.endswith('.npy'):
+				continue
+			try:
+				stat = os.stat(os.path.join(self.path, name))
+			except FileNotFoundError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, name))
+
+		total_size = sum(size for _, size, _ in entries)
+		for _, size, name in sorted(entries):
+			if total_size <= self.max_bytes:
+				break
+			try:
+				os.remove(os.path.join(self.path, name))
+			except FileNotFoundError:
+				pass
+			total_size -= size
+
+	def clear(self):
+		for name in os.listdir(self.path):
+			if name.endswith('.npy'):
+				os.remove(os.path.join(self.path, name))